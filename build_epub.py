@@ -5,21 +5,41 @@ Build script to generate a valid EPUB 3 from the Living Enlightenment source.
 Usage:
     python3 build_epub.py
 
+Set SOURCE_DATE_EPOCH to fix the dcterms:modified date in content.opf; with
+it, identical inputs produce a byte-identical .epub.
+
 1. Discovers chapter XHTML files (ch*.xhtml) in OEBPS/Text/
 2. Reads each file to extract title and level (from epub:type) for the TOC
 3. Generates OEBPS/toc.xhtml (navigation) and OEBPS/content.opf (manifest)
 4. Packages the full directory structure into a .epub (zip) file
 
+If none of the inputs changed since the last build (tracked in a .stamp file
+next to the .epub), the build is skipped. Delete the .stamp to force one.
+
 Source: XHTML chapter files in this directory (OEBPS/Text/). Static files
 (mimetype, META-INF/, Styles/, Images/, cover.xhtml, title-page.xhtml) are
 maintained on disk.
 """
 
+import hashlib
+import html
+import io
 import os
-import re
+import shutil
+import stat
 import subprocess
+import xml.parsers.expat
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from operator import itemgetter
+
+# python-isal (Intel ISA-L) is a faster drop-in for zlib's DEFLATE and CRC-32;
+# fall back to the standard library if it is not installed.
+try:
+    from isal import isal_zlib as zlib
+except ImportError:
+    import zlib
 
 # --- Configuration -----------------------------------------------------------
 
@@ -28,10 +48,20 @@ OUTPUT_EPUB = os.path.join(
     SCRIPT_DIR,
     "Living Enlightenment - Unabridged - 7th Edition.epub",
 )
+# Digest of the build inputs that produced OUTPUT_EPUB
+OUTPUT_STAMP = OUTPUT_EPUB + ".stamp"
 
 OEBPS_DIR = os.path.join(SCRIPT_DIR, "OEBPS")
 TEXT_DIR = os.path.join(OEBPS_DIR, "Text")
 
+# Prettier's --cache file; unchanged files are skipped on later builds
+PRETTIER_CACHE = os.path.join(SCRIPT_DIR, ".prettier-cache")
+
+# Chunk size for streaming chapter files into the parser. Parsing stops once
+# <title> and the first <section epub:type> are seen, so most chapters are
+# done after the first chunk.
+READ_CHUNK_BYTES = 8192
+
 BOOK_TITLE = "Living Enlightenment, Unabridged, 7th Edition"
 BOOK_AUTHOR = "KAILASA\u2019s SPH JGM HDH Bhagavan Sri Nithyananda Paramashivam"
 BOOK_LANGUAGE = "en"
@@ -51,55 +81,142 @@ MAJOR_SECTIONS = [
         ],
     ),
 ]
+# Part ids that appear under some major section
+_MAJOR_PART_SET = frozenset(pid for _, pids in MAJOR_SECTIONS for pid in pids)
 
 # --- Chapter discovery from OEBPS/Text ---------------------------------------
 
+# Escapes for interpolating text into XHTML/XML markup and attribute values
+_XML_ESCAPE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;"})
 
-def discover_chapters() -> list[dict]:
+
+class _HeadParsed(Exception):
+    """Raised from the expat handlers once title and section type are known."""
+
+
+def _expat_extract(path: str) -> tuple[str | None, str | None]:
     """
-    Find all ch*.xhtml files in OEBPS/Text/, sort them, and read title + level
-    from each file. Returns a list of dicts: filename, id, title, level.
+    Stream a chapter file through expat and return (title, epub_type) from the
+    <title> text and the first <section> carrying an epub:type attribute.
+    Either is None if the document has none.
     """
-    chapters = []
-    filenames = sorted(
-        f for f in os.listdir(TEXT_DIR)
-        if f.startswith("ch") and f.endswith(".xhtml")
-    )
-    for filename in filenames:
-        # ch000-preface.xhtml -> id = "preface"
-        stem = filename[:-6]  # drop .xhtml
-        parts = stem.split("-", 1)
-        chapter_id = parts[1] if len(parts) > 1 else stem
-
-        filepath = os.path.join(TEXT_DIR, filename)
-        with open(filepath, "r", encoding="utf-8") as f:
-            content = f.read()
-
-        title_match = re.search(r"<title>(.*?)</title>", content, re.DOTALL)
-        title = title_match.group(1).strip() if title_match else chapter_id
-        title = re.sub(r"<[^>]+>", "", title)
-        title = (
-            title.replace("&rsquo;", "\u2019")
-            .replace("&lsquo;", "\u2018")
-            .replace("&rdquo;", "\u201d")
-            .replace("&ldquo;", "\u201c")
-            .replace("&amp;", "&")
-        )
+    title_parts = []
+    in_title = False
+    title = None
+    epub_type = None
+
+    def start(name, attrs):
+        nonlocal in_title, epub_type
+        if name == "title" and title is None:
+            in_title = True
+        elif name == "section" and epub_type is None and "epub:type" in attrs:
+            epub_type = attrs["epub:type"]
+            if title is not None:
+                raise _HeadParsed
+
+    def end(name):
+        nonlocal in_title, title
+        if name == "title" and in_title:
+            in_title = False
+            title = "".join(title_parts).strip()
+            if epub_type is not None:
+                raise _HeadParsed
+
+    def text(data):
+        if in_title:
+            title_parts.append(data)
+
+    def skipped_entity(name, is_parameter_entity):
+        # HTML named entities (&rsquo; etc.) are not declared in XHTML files
+        if in_title and not is_parameter_entity:
+            title_parts.append(html.unescape(f"&{name};"))
+
+    parser = xml.parsers.expat.ParserCreate()
+    # Pretend there is an external DTD so undeclared entities are skipped
+    # instead of being fatal.
+    parser.UseForeignDTD(True)
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = text
+    parser.SkippedEntityHandler = skipped_entity
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        while True:
+            chunk = os.read(fd, READ_CHUNK_BYTES)
+            parser.Parse(chunk, not chunk)
+            if not chunk:
+                break
+    except _HeadParsed:
+        pass
+    except xml.parsers.expat.ExpatError as e:
+        raise ValueError(f"{path}: {e}") from e
+    finally:
+        os.close(fd)
+    return title, epub_type
+
+
+def _parse_chapter(entry: os.DirEntry) -> dict:
+    """
+    Read one chapter file from OEBPS/Text/ and extract its title + level.
+    Returns a dict: filename, id, item_id, title, title_xml (XML-escaped),
+    level.
+    """
+    filename = entry.name
+    # ch000-preface.xhtml -> id = "preface", item_id = "ch000"
+    stem = filename[:-6]  # drop .xhtml
+    parts = stem.split("-", 1)
+    chapter_id = parts[1] if len(parts) > 1 else stem
+    item_id = parts[0]
+
+    title, epub_type = _expat_extract(entry.path)
+    if title is None:
+        title = chapter_id
+
+    # level 2 = part (section), level 3 = chapter
+    level = 2 if epub_type == "part" else 3
+
+    return {
+        "filename": filename,
+        "id": chapter_id,
+        "item_id": item_id,
+        "title": title,
+        "title_xml": title.translate(_XML_ESCAPE),
+        "level": level,
+    }
+
+
+def _chapter_sort_key(filename: str) -> tuple:
+    """
+    ch012-slug.xhtml -> (0, 12, filename), so ch1000 sorts after ch999.
+    Files without a number after "ch" sort last, by name.
+    """
+    number = filename[2:-6].split("-", 1)[0]
+    if number.isdigit():
+        return (0, int(number), filename)
+    return (1, 0, filename)
 
-        # level 2 = part (section), level 3 = chapter
-        type_match = re.search(
-            r'<section[^>]*\bepub:type="([^"]+)"', content
-        )
-        epub_type = type_match.group(1) if type_match else "chapter"
-        level = 2 if epub_type == "part" else 3
 
-        chapters.append({
-            "filename": filename,
-            "id": chapter_id,
-            "title": title,
-            "level": level,
-        })
-    return chapters
+def discover_chapters() -> list[dict]:
+    """
+    Find all ch*.xhtml files in OEBPS/Text/, sort them by chapter number, and
+    read title + level from each file. Returns a list of dicts: filename, id,
+    item_id, title, title_xml, level.
+
+    Files are read on a thread pool (the work is mostly small-file I/O);
+    map() keeps the results in sorted order.
+    """
+    with os.scandir(TEXT_DIR) as it:
+        keyed = [
+            (_chapter_sort_key(e.name), e) for e in it
+            if e.name.startswith("ch") and e.name.endswith(".xhtml")
+        ]
+    if not keyed:
+        return []
+    keyed.sort(key=itemgetter(0))
+    entries = [e for _, e in keyed]
+    with ThreadPoolExecutor(max_workers=min(16, len(entries))) as executor:
+        return list(executor.map(_parse_chapter, entries))
 
 
 def chapter_item_id(filename: str) -> str:
@@ -109,32 +226,22 @@ def chapter_item_id(filename: str) -> str:
 
 # --- content.opf ------------------------------------------------------------
 
+_MANIFEST_TPL = '    <item id="{id}" href="Text/{fn}" media-type="application/xhtml+xml" />\n'
+_SPINE_TPL = '    <itemref idref="{id}" />\n'
 
-def build_content_opf(chapters: list[dict]) -> str:
-    now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
-
-    manifest_items = [
-        '    <item id="cover-image" href="Images/cover.jpg" media-type="image/jpeg" properties="cover-image" />',
-        '    <item id="style" href="Styles/style.css" media-type="text/css" />',
-        '    <item id="nav" href="toc.xhtml" media-type="application/xhtml+xml" properties="nav" />',
-        '    <item id="cover" href="Text/cover.xhtml" media-type="application/xhtml+xml" />',
-        '    <item id="title-page" href="Text/title-page.xhtml" media-type="application/xhtml+xml" />',
-    ]
-    spine_items = [
-        '    <itemref idref="cover" />',
-        '    <itemref idref="title-page" />',
-        '    <itemref idref="nav" />',
-    ]
-
-    for ch in chapters:
-        item_id = chapter_item_id(ch["filename"])
-        fname = ch["filename"]
-        manifest_items.append(
-            f'    <item id="{item_id}" href="Text/{fname}" media-type="application/xhtml+xml" />'
-        )
-        spine_items.append(f'    <itemref idref="{item_id}" />')
 
-    return f"""\
+def build_content_opf(chapters: list[dict]) -> str:
+    # SOURCE_DATE_EPOCH pins the modified date for reproducible builds
+    epoch = os.environ.get("SOURCE_DATE_EPOCH")
+    if epoch:
+        modified = datetime.fromtimestamp(int(epoch), tz=timezone.utc)
+    else:
+        modified = datetime.now(timezone.utc)
+    modified = modified.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    buf = io.StringIO()
+    w = buf.write
+    w(f"""\
 <?xml version="1.0" encoding="utf-8"?>
 <package xmlns="http://www.idpf.org/2007/opf" unique-identifier="BookId" version="3.0">
   <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
@@ -142,16 +249,31 @@ def build_content_opf(chapters: list[dict]) -> str:
     <dc:title>{BOOK_TITLE}</dc:title>
     <dc:creator>{BOOK_AUTHOR}</dc:creator>
     <dc:language>{BOOK_LANGUAGE}</dc:language>
-    <meta property="dcterms:modified">{now}</meta>
+    <meta property="dcterms:modified">{modified}</meta>
   </metadata>
   <manifest>
-{chr(10).join(manifest_items)}
+    <item id="cover-image" href="Images/cover.jpg" media-type="image/jpeg" properties="cover-image" />
+    <item id="style" href="Styles/style.css" media-type="text/css" />
+    <item id="nav" href="toc.xhtml" media-type="application/xhtml+xml" properties="nav" />
+    <item id="cover" href="Text/cover.xhtml" media-type="application/xhtml+xml" />
+    <item id="title-page" href="Text/title-page.xhtml" media-type="application/xhtml+xml" />
+""")
+    for ch in chapters:
+        w(_MANIFEST_TPL.format(id=ch["item_id"], fn=ch["filename"]))
+    w("""\
   </manifest>
   <spine>
-{chr(10).join(spine_items)}
+    <itemref idref="cover" />
+    <itemref idref="title-page" />
+    <itemref idref="nav" />
+""")
+    for ch in chapters:
+        w(_SPINE_TPL.format(id=ch["item_id"]))
+    w("""\
   </spine>
 </package>
-"""
+""")
+    return buf.getvalue()
 
 
 # --- toc.xhtml --------------------------------------------------------------
@@ -164,15 +286,18 @@ def build_toc_xhtml(chapters: list[dict]) -> str:
     # Split into front matter (until first part) and part tree
     front_items = []  # list of {title, href}
     parts_by_id = {}  # part_id -> {title, href, children: [{title, href}, ...]}
+    orphan_part_ids = []  # parts not listed in MAJOR_SECTIONS, in book order
     current_part_id = None
 
     for ch in chapters:
         href = f"Text/{ch['filename']}"
-        entry = {"title": ch["title"], "href": href}
+        entry = {"title": ch["title_xml"], "href": href}
 
         if ch["level"] == 2:
             current_part_id = ch["id"]
-            parts_by_id[ch["id"]] = {"title": ch["title"], "href": href, "children": []}
+            parts_by_id[ch["id"]] = {"title": ch["title_xml"], "href": href, "children": []}
+            if ch["id"] not in _MAJOR_PART_SET:
+                orphan_part_ids.append(ch["id"])
         else:
             if current_part_id is not None:
                 parts_by_id[current_part_id]["children"].append(entry)
@@ -180,50 +305,49 @@ def build_toc_xhtml(chapters: list[dict]) -> str:
                 front_items.append(entry)
 
     # Build HTML: front list, then for each major section: h2 + ol(part li with ol(children))
-    part_ids_used = set()
-    lines = []
+    buf = io.StringIO()
+    w = buf.write
 
     # Front matter (Preface, Introduction) in its own list
-    lines.append('    <ol class="toc-front-matter">')
+    w('    <ol class="toc-front-matter">\n')
     for e in front_items:
-        lines.append(f'      <li class="toc-front"><a href="{e["href"]}">{e["title"]}</a></li>')
-    lines.append('    </ol>')
+        w(f'      <li class="toc-front"><a href="{e["href"]}">{e["title"]}</a></li>\n')
+    w('    </ol>\n')
 
     # Major sections
     for section_title, part_ids in MAJOR_SECTIONS:
-        lines.append(f'    <h2 class="toc-section">{section_title}</h2>')
-        lines.append('    <ol class="toc-parts">')
+        w(f'    <h2 class="toc-section">{section_title}</h2>\n')
+        w('    <ol class="toc-parts">\n')
         for pid in part_ids:
             if pid not in parts_by_id:
                 continue
-            part_ids_used.add(pid)
             part = parts_by_id[pid]
-            lines.append(f'      <li class="toc-part">')
-            lines.append(f'        <a href="{part["href"]}">{part["title"]}</a>')
+            w(f'      <li class="toc-part">\n')
+            w(f'        <a href="{part["href"]}">{part["title"]}</a>\n')
             if part["children"]:
-                lines.append('        <ol class="toc-chapters">')
+                w('        <ol class="toc-chapters">\n')
                 for c in part["children"]:
-                    lines.append(f'          <li><a href="{c["href"]}">{c["title"]}</a></li>')
-                lines.append('        </ol>')
-            lines.append('      </li>')
-        lines.append('    </ol>')
+                    w(f'          <li><a href="{c["href"]}">{c["title"]}</a></li>\n')
+                w('        </ol>\n')
+            w('      </li>\n')
+        w('    </ol>\n')
 
     # Any part not in MAJOR_SECTIONS (e.g. if config is incomplete)
-    orphan_parts = [(pid, parts_by_id[pid]) for pid in parts_by_id if pid not in part_ids_used]
-    if orphan_parts:
-        lines.append('    <ol class="toc-parts">')
-        for _pid, part in orphan_parts:
-            lines.append('      <li class="toc-part">')
-            lines.append(f'        <a href="{part["href"]}">{part["title"]}</a>')
+    if orphan_part_ids:
+        w('    <ol class="toc-parts">\n')
+        for pid in orphan_part_ids:
+            part = parts_by_id[pid]
+            w('      <li class="toc-part">\n')
+            w(f'        <a href="{part["href"]}">{part["title"]}</a>\n')
             if part["children"]:
-                lines.append('        <ol class="toc-chapters">')
+                w('        <ol class="toc-chapters">\n')
                 for c in part["children"]:
-                    lines.append(f'          <li><a href="{c["href"]}">{c["title"]}</a></li>')
-                lines.append('        </ol>')
-            lines.append('      </li>')
-        lines.append('    </ol>')
+                    w(f'          <li><a href="{c["href"]}">{c["title"]}</a></li>\n')
+                w('        </ol>\n')
+            w('      </li>\n')
+        w('    </ol>\n')
 
-    toc_body = "\n".join(lines)
+    toc_body = buf.getvalue()
 
     return f"""\
 <?xml version="1.0" encoding="utf-8"?>
@@ -237,8 +361,7 @@ def build_toc_xhtml(chapters: list[dict]) -> str:
 <body>
   <nav epub:type="toc" id="toc">
     <h1 class="toc-title">Contents</h1>
-{toc_body}
-  </nav>
+{toc_body}  </nav>
 </body>
 </html>
 """
@@ -246,8 +369,150 @@ def build_toc_xhtml(chapters: list[dict]) -> str:
 
 # --- Build -------------------------------------------------------------------
 
+# Buffer size for copying files into the archive
+ZIP_COPY_BUFFER = 1 << 20
+
+# Fixed timestamp and permissions for every archive entry, so that identical
+# inputs produce a byte-identical epub
+ZIP_DATE_TIME = (2000, 1, 1, 0, 0, 0)
+ZIP_EXTERNAL_ATTR = (stat.S_IFREG | 0o644) << 16
+
+# Directories under SCRIPT_DIR packaged into the epub after mimetype
+EPUB_ROOTS = ("META-INF", "OEBPS")
+
+# Already-compressed formats; DEFLATE cannot shrink these, so they are stored.
+INCOMPRESSIBLE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".woff2", ".otf"}
+
+
+def iter_epub_files(root: str):
+    """
+    Recursively yield (full_path, filename) for files under root, files in a
+    directory sorted by name before its subdirectories. Hidden files and
+    directories (e.g. .DS_Store) are skipped.
+    """
+    with os.scandir(root) as it:
+        dir_entries = sorted(
+            (e for e in it if not e.name.startswith(".")), key=lambda e: e.name
+        )
+    subdirs = []
+    for entry in dir_entries:
+        if entry.is_dir():
+            subdirs.append(entry.path)
+        else:
+            yield entry.path, entry.name
+    for subdir in subdirs:
+        yield from iter_epub_files(subdir)
+
+
+def epub_zipinfo(arcname: str, compress_type: int) -> zipfile.ZipInfo:
+    """ZipInfo for arcname with the fixed ZIP_DATE_TIME / ZIP_EXTERNAL_ATTR."""
+    zinfo = zipfile.ZipInfo(arcname, date_time=ZIP_DATE_TIME)
+    zinfo.compress_type = compress_type
+    zinfo.external_attr = ZIP_EXTERNAL_ATTR
+    return zinfo
+
+
+def write_zip_entry(
+    epub: zipfile.ZipFile, full_path: str, arcname: str, compress_type: int
+) -> None:
+    """Stream one file into the archive in ZIP_COPY_BUFFER-sized reads."""
+    zinfo = epub_zipinfo(arcname, compress_type)
+    # Lets zipfile decide up front whether the entry needs zip64
+    zinfo.file_size = os.path.getsize(full_path)
+    with open(full_path, "rb") as src, epub.open(zinfo, "w") as dst:
+        shutil.copyfileobj(src, dst, ZIP_COPY_BUFFER)
+
+
+def deflate_file(full_path: str) -> tuple[bytes, int, int]:
+    """
+    Read and raw-DEFLATE one file the way zipfile would for ZIP_DEFLATED.
+    Returns (compressed bytes, CRC-32, uncompressed size).
+    """
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    chunks = []
+    crc = 0
+    size = 0
+    with open(full_path, "rb") as src:
+        while chunk := src.read(ZIP_COPY_BUFFER):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            chunks.append(compressor.compress(chunk))
+    chunks.append(compressor.flush())
+    return b"".join(chunks), crc, size
+
+
+def write_deflated_entry(
+    epub: zipfile.ZipFile, arcname: str, blob: bytes, crc: int, size: int
+) -> None:
+    """
+    Append an entry whose data was already compressed by deflate_file().
+    zipfile has no public API for raw writes, so this mirrors what
+    ZipFile._open_to_write and _ZipWriteFile.close do for a seekable file.
+    """
+    zinfo = epub_zipinfo(arcname, zipfile.ZIP_DEFLATED)
+    zinfo.CRC = crc
+    zinfo.file_size = size
+    zinfo.compress_size = len(blob)
+
+    epub.fp.seek(epub.start_dir)
+    zinfo.header_offset = epub.fp.tell()
+    epub._writecheck(zinfo)
+    epub._didModify = True
+    epub.fp.write(zinfo.FileHeader())
+    epub.fp.write(blob)
+    epub.start_dir = epub.fp.tell()
+    epub.filelist.append(zinfo)
+    epub.NameToInfo[zinfo.filename] = zinfo
+
+
+def write_utf8(path: str, text: str) -> None:
+    """Encode text once and write it with raw os.write calls (no TextIOWrapper)."""
+    data = memoryview(text.encode("utf-8"))
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        while data:
+            data = data[os.write(fd, data):]
+    finally:
+        os.close(fd)
+
+
+def input_signature(generated: set[str]) -> str:
+    """
+    Digest of (path, mtime, size) for everything the build reads: this
+    script, mimetype and the EPUB_ROOTS trees minus the generated files, plus
+    SOURCE_DATE_EPOCH.
+    """
+    paths = [os.path.abspath(__file__), os.path.join(SCRIPT_DIR, "mimetype")]
+    for root in EPUB_ROOTS:
+        paths.extend(
+            full_path
+            for full_path, _filename in iter_epub_files(os.path.join(SCRIPT_DIR, root))
+            if full_path not in generated
+        )
+    sig = hashlib.blake2b(digest_size=16)
+    # Changes the dcterms:modified written to content.opf
+    sig.update(f"SOURCE_DATE_EPOCH={os.environ.get('SOURCE_DATE_EPOCH', '')}\n".encode("utf-8"))
+    for path in sorted(paths):
+        st = os.stat(path)
+        arcname = os.path.relpath(path, SCRIPT_DIR)
+        sig.update(f"{arcname}\0{st.st_mtime_ns}\0{st.st_size}\n".encode("utf-8"))
+    return sig.hexdigest()
+
 
 def build_epub():
+    toc_path = os.path.join(OEBPS_DIR, "toc.xhtml")
+    opf_path = os.path.join(OEBPS_DIR, "content.opf")
+
+    # Skip the whole build if no input changed since the last one
+    signature = input_signature({toc_path, opf_path})
+    if os.path.exists(OUTPUT_EPUB) and os.path.exists(OUTPUT_STAMP):
+        with open(OUTPUT_STAMP, "r", encoding="utf-8") as f:
+            if f.read().strip() == signature:
+                print(f"Up to date: {OUTPUT_EPUB}")
+                return
+    if os.path.exists(OUTPUT_STAMP):
+        os.remove(OUTPUT_STAMP)
+
     print(f"Source: {TEXT_DIR}")
     print("Discovering chapters...")
     chapters = discover_chapters()
@@ -256,28 +521,27 @@ def build_epub():
         print(f"  {i:3d}. [{ch['level']}] {ch['filename']}")
 
     # --- Step 1: Write toc.xhtml ---
-    toc_path = os.path.join(OEBPS_DIR, "toc.xhtml")
-    with open(toc_path, "w", encoding="utf-8") as f:
-        f.write(build_toc_xhtml(chapters))
+    write_utf8(toc_path, build_toc_xhtml(chapters))
     print(f"  Wrote toc.xhtml")
 
     # --- Step 2: Write content.opf ---
-    opf_path = os.path.join(OEBPS_DIR, "content.opf")
-    with open(opf_path, "w", encoding="utf-8") as f:
-        f.write(build_content_opf(chapters))
+    write_utf8(opf_path, build_content_opf(chapters))
     print(f"  Wrote content.opf")
 
     # --- Step 3: Format generated files with Prettier ---
+    # Chapter files are static inputs and are not rewritten here. content.opf
+    # is left alone too: the html parser would treat its <meta> as a void
+    # element.
     print("\nFormatting with Prettier...")
-    generated_files = [toc_path] + [
-        os.path.join(TEXT_DIR, ch["filename"]) for ch in chapters
-    ]
+    generated_files = [toc_path]
     try:
         subprocess.run(
-            ["npx", "prettier", "--write", "--parser", "html",
+            ["npx", "prettier", "--write",
+             "--cache", "--cache-location", PRETTIER_CACHE,
+             "--log-level=error", "--no-editorconfig", "--parser", "html",
              "--prose-wrap", "always", "--print-width", "80", "--tab-width", "2"]
             + generated_files,
-            capture_output=True, text=True, check=True,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True,
         )
         print(f"  Formatted {len(generated_files)} files")
     except (subprocess.CalledProcessError, FileNotFoundError) as e:
@@ -291,27 +555,37 @@ def build_epub():
     with zipfile.ZipFile(OUTPUT_EPUB, "w", zipfile.ZIP_DEFLATED) as epub:
         # mimetype MUST be first and stored uncompressed
         mimetype_path = os.path.join(SCRIPT_DIR, "mimetype")
-        epub.write(mimetype_path, "mimetype", compress_type=zipfile.ZIP_STORED)
-
-        # Walk the directory tree and add all EPUB files
-        for dirpath, dirnames, filenames in os.walk(SCRIPT_DIR):
-            # Skip hidden dirs, the script itself, and the output epub
-            dirnames[:] = [
-                d for d in dirnames
-                if not d.startswith(".") and d != "__pycache__"
-            ]
+        write_zip_entry(epub, mimetype_path, "mimetype", zipfile.ZIP_STORED)
 
-            for filename in sorted(filenames):
-                full_path = os.path.join(dirpath, filename)
+        # Collect the EPUB content trees (everything but mimetype)
+        entries = []  # (full_path, arcname, compress_type)
+        for root in EPUB_ROOTS:
+            for full_path, filename in iter_epub_files(os.path.join(SCRIPT_DIR, root)):
                 arcname = os.path.relpath(full_path, SCRIPT_DIR)
-
-                # Skip: mimetype (already added), build script, epub output, non-epub files
-                if arcname == "mimetype":
-                    continue
-                if filename.endswith((".py", ".epub", ".DS_Store")):
-                    continue
-
-                epub.write(full_path, arcname, compress_type=zipfile.ZIP_DEFLATED)
+                ext = os.path.splitext(filename)[1].lower()
+                if ext in INCOMPRESSIBLE_EXTENSIONS:
+                    compress_type = zipfile.ZIP_STORED
+                else:
+                    compress_type = zipfile.ZIP_DEFLATED
+                entries.append((full_path, arcname, compress_type))
+
+        # Compress on a thread pool (zlib releases the GIL while deflating),
+        # then append the entries in walk order.
+        with ThreadPoolExecutor() as executor:
+            futures = [
+                executor.submit(deflate_file, full_path)
+                if compress_type == zipfile.ZIP_DEFLATED else None
+                for full_path, _arcname, compress_type in entries
+            ]
+            for (full_path, arcname, compress_type), future in zip(entries, futures):
+                if future is None:
+                    write_zip_entry(epub, full_path, arcname, compress_type)
+                else:
+                    blob, crc, size = future.result()
+                    write_deflated_entry(epub, arcname, blob, crc, size)
+
+    with open(OUTPUT_STAMP, "w", encoding="utf-8") as f:
+        f.write(signature + "\n")
 
     file_size = os.path.getsize(OUTPUT_EPUB)
     print(f"\nDone! {OUTPUT_EPUB}")